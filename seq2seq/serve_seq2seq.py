@@ -10,21 +10,33 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-from typing import Optional, Dict
+from typing import Optional, List, Tuple
 from dataclasses import dataclass, field
-from pydantic import BaseModel
 import os
+import re
+import asyncio
+import threading
+from collections import OrderedDict
+import torch
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import pathname2url
 from contextlib import nullcontext
 from transformers.hf_argparser import HfArgumentParser
 from transformers.models.auto import AutoConfig, AutoTokenizer, AutoModelForSeq2SeqLM
 from fastapi import FastAPI, HTTPException
 from uvicorn import run
 from sqlite3 import Connection, connect, OperationalError
-from seq2seq.utils.pipeline import Text2SQLGenerationPipeline, Text2SQLInput, get_schema
+from seq2seq.utils.pipeline import Text2SQLGenerationPipeline, Text2SQLInput, get_db_file_path
 from seq2seq.utils.picard_model_wrapper import PicardArguments, PicardLauncher, with_picard
 from seq2seq.utils.dataset import DataTrainingArguments
 
 
+QUANTIZABLE_LINEAR_PATTERN = re.compile(
+    r"\.(SelfAttention|EncDecAttention)\.[qkvo]$"
+    r"|\.DenseReluDense\.(wi|wi_0|wi_1|wo)$"
+)
+
+
 @dataclass
 class BackendArguments:
     """
@@ -51,6 +63,37 @@ class BackendArguments:
             "help": "Device ordinal for CPU/GPU supports. Setting this to -1 will leverage CPU. A non-negative value will run the model on the corresponding CUDA device id."
         },
     )
+    fp16: bool = field(
+        default=False,
+        metadata={"help": "Whether or not to run the model in half precision. Only supported on CUDA devices."},
+    )
+    max_batch_size: int = field(
+        default=8,
+        metadata={"help": "The maximum number of concurrent requests that are batched together for generation."},
+    )
+    max_batch_delay: float = field(
+        default=10.0,
+        metadata={"help": "The maximum time in milliseconds to wait for further requests before generating a batch."},
+    )
+    max_rows: Optional[int] = field(
+        default=None,
+        metadata={
+            "help": "The maximum number of rows returned from executing a generated query. "
+            "Results with more rows are cut off and marked as ``truncated``. By default, all rows are returned."
+        },
+    )
+    quantize: bool = field(
+        default=False,
+        metadata={"help": "Whether or not to quantize the linear layers of the model to INT8. Only supported on CPU."},
+    )
+
+    def __post_init__(self):
+        if self.max_rows is not None and self.max_rows <= 0:
+            raise ValueError("`max_rows` must be a positive integer.")
+        if self.quantize and self.device >= 0:
+            raise ValueError("INT8 quantization is only supported on CPU, set `device` to -1.")
+        if self.fp16 and self.device < 0:
+            raise ValueError("Half precision is only supported on CUDA devices, set `device` to a non-negative value.")
 
 
 def main():
@@ -99,6 +142,17 @@ def main():
             config=config,
             cache_dir=backend_args.cache_dir,
         )
+        model.eval()
+        if backend_args.fp16:
+            model = model.half()
+        if backend_args.quantize:
+            # Only quantize the attention and feed-forward projections of the T5 blocks, `lm_head` stays in FP32
+            qconfig_spec = {
+                name: torch.quantization.default_dynamic_qconfig
+                for name, module in model.named_modules()
+                if isinstance(module, torch.nn.Linear) and QUANTIZABLE_LINEAR_PATTERN.search(name)
+            }
+            model = torch.quantization.quantize_dynamic(model, qconfig_spec, dtype=torch.qint8, inplace=True)
 
         # Initalize generation pipeline
         pipe = Text2SQLGenerationPipeline(
@@ -116,35 +170,132 @@ def main():
         # Initialize REST API
         app = FastAPI()
 
-        class AskResponse(BaseModel):
-            query: str
-            execution_results: list
-        
-        def response(query: str, conn: Connection) -> AskResponse:
+        # The model is not thread-safe, hence all generation runs on a single dedicated thread
+        inference_executor = ThreadPoolExecutor(max_workers=1)
+        sqlite_executor = ThreadPoolExecutor(max_workers=8)
+
+        def response(query: str, conn: Connection) -> dict:
             try:
-                return AskResponse(query=query, execution_results=conn.execute(query).fetchall())
+                cursor = conn.execute(query)
+                if backend_args.max_rows is None:
+                    return {"query": query, "execution_results": cursor.fetchall(), "truncated": False}
+                # fetch one extra row to tell whether the result has been cut off
+                execution_results = cursor.fetchmany(backend_args.max_rows + 1)
+                return {
+                    "query": query,
+                    "execution_results": execution_results[: backend_args.max_rows],
+                    "truncated": len(execution_results) > backend_args.max_rows,
+                }
             except OperationalError as e:
                 raise HTTPException(
                     status_code=500, detail=f'while executing "{query}", the following error occurred: {e.args[0]}'
                 )
 
-        @app.get("/ask/{db_id}/{question}")
-        def ask(db_id: str, question: str):
+        # Connections are cached per worker thread so that queries against the same database can run in parallel.
+        # A connection is reopened whenever the database file has been replaced or modified.
+        ro_conns = threading.local()
+
+        def get_ro_conn(db_id: str) -> Connection:
+            if not hasattr(ro_conns, "cache"):
+                ro_conns.cache = OrderedDict()
+            cache: "OrderedDict[str, Tuple[Tuple[int, int], Connection]]" = ro_conns.cache
+            db_file_path = get_db_file_path(db_path=backend_args.db_path, db_id=db_id)
+            db_file_stat = os.stat(db_file_path)
+            db_file_version = (db_file_stat.st_ino, db_file_stat.st_mtime_ns)
+            if db_id in cache:
+                version, conn = cache.pop(db_id)
+                if version == db_file_version:
+                    cache[db_id] = (version, conn)
+                    return conn
+                conn.close()
+            conn = connect(f"file:{pathname2url(db_file_path)}?mode=ro", uri=True)
+            conn.execute("PRAGMA mmap_size=268435456")
+            conn.execute("PRAGMA query_only=ON")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            cache[db_id] = (db_file_version, conn)
+            if len(cache) > 32:
+                _, (_, evicted_conn) = cache.popitem(last=False)
+                evicted_conn.close()
+            return conn
+
+        def execute(db_id: str, query: str) -> dict:
             try:
+                conn = get_ro_conn(db_id)
+            except FileNotFoundError:
+                raise HTTPException(status_code=404, detail=f"database not found: {db_id}")
+            return response(query=query, conn=conn)
+
+        def generate(inputs: List[Text2SQLInput]) -> List[List[dict]]:
+            with torch.inference_mode():
                 outputs = pipe(
-                    inputs=Text2SQLInput(utterance=question, db_id=db_id),
-                    num_return_sequences=data_training_args.num_return_sequences
+                    inputs=inputs,
+                    num_return_sequences=data_training_args.num_return_sequences,
+                    batch_size=len(inputs),
                 )
+            # the pipeline unwraps the outputs if there is only one sequence per input
+            return [output if isinstance(output, list) else [output] for output in outputs]
+
+        queue: "asyncio.Queue[Tuple[Text2SQLInput, asyncio.Future]]"
+        batch_generate_task: "asyncio.Task[None]"
+
+        async def run_batch(batch: List[Tuple[Text2SQLInput, asyncio.Future]]) -> None:
+            try:
+                outputs = await asyncio.get_running_loop().run_in_executor(
+                    inference_executor, generate, [input for input, _ in batch]
+                )
+            except Exception as e:
+                if len(batch) > 1:
+                    # retry one by one so that a single bad request does not fail the whole batch
+                    for item in batch:
+                        await run_batch([item])
+                else:
+                    _, future = batch[0]
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            for (_, future), output in zip(batch, outputs):
+                if not future.done():
+                    future.set_result(output)
+
+        async def batch_generate() -> None:
+            loop = asyncio.get_running_loop()
+            while True:
+                batch = [await queue.get()]
+                deadline = loop.time() + backend_args.max_batch_delay / 1000
+                while len(batch) < backend_args.max_batch_size:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(queue.get(), timeout=timeout))
+                    except asyncio.TimeoutError:
+                        break
+                await run_batch(batch)
+
+        @app.on_event("startup")
+        async def start_batch_generate() -> None:
+            nonlocal queue, batch_generate_task
+            queue = asyncio.Queue()
+            # keep a reference, the event loop only holds weak references to tasks
+            batch_generate_task = asyncio.create_task(batch_generate())
+
+        @app.get("/ask/{db_id}/{question}")
+        async def ask(db_id: str, question: str):
+            future = asyncio.get_running_loop().create_future()
+            await queue.put((Text2SQLInput(utterance=question, db_id=db_id), future))
+            try:
+                outputs = await future
             except OperationalError as e:
                 raise HTTPException(status_code=404, detail=e.args[0])
-            try:
-                conn = connect(backend_args.db_path + "/" + db_id + "/" + db_id + ".sqlite")
-                return [response(query=output["generated_text"], conn=conn) for output in outputs]
-            finally:
-                conn.close()
+            except FileNotFoundError:
+                raise HTTPException(status_code=404, detail=f"database not found: {db_id}")
+            loop = asyncio.get_running_loop()
+            return await asyncio.gather(
+                *(loop.run_in_executor(sqlite_executor, execute, db_id, output["generated_text"]) for output in outputs)
+            )
 
         # Run app
-        run(app=app, host=backend_args.host, port=backend_args.port)
+        run(app=app, host=backend_args.host, port=backend_args.port, access_log=False)
 
 
 if __name__ == "__main__":
@@ -391,20 +391,18 @@ def serialize_schema(
         else:
             return column_str_without_values.format(column=column_name_str)
 
+    # group the columns by table in a single pass instead of scanning all columns for every table
+    table_column_names: List[List[str]] = [[] for _ in db_table_names]
+    for table_id, column_name in zip(db_column_names["table_id"], db_column_names["column_name"]):
+        if 0 <= table_id < len(db_table_names):
+            table_column_names[table_id].append(column_name)
+
     tables = [
         table_str.format(
             table=table_name.lower() if normalize_query else table_name,
             columns=column_sep.join(
-                map(
-                    lambda y: get_column_str(table_name=table_name, column_name=y[1]),
-                    filter(
-                        lambda y: y[0] == table_id,
-                        zip(
-                            db_column_names["table_id"],
-                            db_column_names["column_name"],
-                        ),
-                    ),
-                )
+                get_column_str(table_name=table_name, column_name=column_name)
+                for column_name in table_column_names[table_id]
             ),
         )
         for table_id, table_name in enumerate(db_table_names)
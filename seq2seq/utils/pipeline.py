@@ -1,5 +1,7 @@
+import os
 from dataclasses import dataclass
-from typing import Union, List, Dict, Optional
+from typing import Union, List, Dict, Optional, Tuple
+from transformers.models.t5 import T5Tokenizer, T5TokenizerFast
 from transformers.pipelines.text2text_generation import ReturnType, Text2TextGenerationPipeline
 from transformers.tokenization_utils import TruncationStrategy
 from transformers.tokenization_utils_base import BatchEncoding
@@ -42,7 +44,8 @@ class Text2SQLGenerationPipeline(Text2TextGenerationPipeline):
         self.schema_serialization_randomized: bool = kwargs.pop("schema_serialization_randomized", False)
         self.schema_serialization_with_db_id: bool = kwargs.pop("schema_serialization_with_db_id", True)
         self.schema_serialization_with_db_content: bool = kwargs.pop("schema_serialization_with_db_content", True)
-        self.schema_cache: Dict[str, dict] = dict()
+        self.schema_cache: Dict[str, Tuple[int, dict]] = dict()
+        self.schema_input_ids_cache: Dict[str, Tuple[int, List[int]]] = dict()
         super().__init__(*args, **kwargs)
 
     def __call__(self, inputs: Union[Text2SQLInput, List[Text2SQLInput]], *args, **kwargs):
@@ -101,32 +104,54 @@ class Text2SQLGenerationPipeline(Text2TextGenerationPipeline):
         if isinstance(inputs, list):
             if self.tokenizer.pad_token_id is None:
                 raise ValueError("Please make sure that the tokenizer has a pad_token_id when using a batch input")
-            inputs = [self._pre_process(input=input) for input in inputs]
             padding = True
         elif isinstance(inputs, Text2SQLInput):
-            inputs = self._pre_process(input=inputs)
             padding = False
         else:
             raise ValueError(
                 f" `inputs`: {inputs} have the wrong format. The should be either of type `Text2SQLInput` or type `List[Text2SQLInput]`"
             )
-        encodings = self.tokenizer(inputs, padding=padding, truncation=truncation, return_tensors=self.framework)
+        if (
+            self.schema_serialization_with_db_content
+            or self.schema_serialization_randomized
+            or truncation != TruncationStrategy.DO_NOT_TRUNCATE
+            or not isinstance(self.tokenizer, (T5Tokenizer, T5TokenizerFast))
+        ):
+            if isinstance(inputs, list):
+                inputs = [self._pre_process(input=input) for input in inputs]
+            else:
+                inputs = self._pre_process(input=inputs)
+            encodings = self.tokenizer(inputs, padding=padding, truncation=truncation, return_tensors=self.framework)
+        else:
+            # The serialized schema does not depend on the question, hence its token ids can be reused.
+            # This is only done for T5 tokenizers, which split on whitespace before tokenizing, such that
+            # tokenizing the question and the schema separately gives the same ids as tokenizing them together.
+            if isinstance(inputs, list):
+                input_ids = [self._get_input_ids(input=input) for input in inputs]
+            else:
+                input_ids = [self._get_input_ids(input=inputs)]
+            encodings = self.tokenizer.pad({"input_ids": input_ids}, padding=padding, return_tensors=self.framework)
         # This is produced by tokenizers but is an invalid generate kwargs
         if "token_type_ids" in encodings:
             del encodings["token_type_ids"]
         return encodings
 
-    def _pre_process(self, input: Text2SQLInput) -> str:
-        prefix = self.prefix if self.prefix is not None else ""
-        if input.db_id not in self.schema_cache:
-            self.schema_cache[input.db_id] = get_schema(db_path=self.db_path, db_id=input.db_id)
-        schema = self.schema_cache[input.db_id]
+    def _get_schema(self, db_id: str) -> Tuple[int, dict]:
+        db_file_mtime, schema = get_cached_schema(
+            schema_cache=self.schema_cache,
+            db_path=self.db_path,
+            db_id=db_id,
+            refresh=not hasattr(self.model, "add_schema"),
+        )
         if hasattr(self.model, "add_schema"):
-            self.model.add_schema(db_id=input.db_id, db_info=schema)
-        serialized_schema = serialize_schema(
-            question=input.utterance,
+            self.model.add_schema(db_id=db_id, db_info=schema)
+        return db_file_mtime, schema
+
+    def _serialize_schema(self, question: str, db_id: str, schema: dict) -> str:
+        return serialize_schema(
+            question=question,
             db_path=self.db_path,
-            db_id=input.db_id,
+            db_id=db_id,
             db_column_names=schema["db_column_names"],
             db_table_names=schema["db_table_names"],
             schema_serialization_type=self.schema_serialization_type,
@@ -135,8 +160,30 @@ class Text2SQLGenerationPipeline(Text2TextGenerationPipeline):
             schema_serialization_with_db_content=self.schema_serialization_with_db_content,
             normalize_query=self.normalize_query,
         )
+
+    def _pre_process(self, input: Text2SQLInput) -> str:
+        prefix = self.prefix if self.prefix is not None else ""
+        _, schema = self._get_schema(db_id=input.db_id)
+        serialized_schema = self._serialize_schema(question=input.utterance, db_id=input.db_id, schema=schema)
         return spider_get_input(question=input.utterance, serialized_schema=serialized_schema, prefix=prefix)
 
+    def _get_input_ids(self, input: Text2SQLInput) -> List[int]:
+        prefix = self.prefix if self.prefix is not None else ""
+        db_file_mtime, schema = self._get_schema(db_id=input.db_id)
+        if (
+            input.db_id not in self.schema_input_ids_cache
+            or self.schema_input_ids_cache[input.db_id][0] != db_file_mtime
+        ):
+            serialized_schema = self._serialize_schema(question=input.utterance, db_id=input.db_id, schema=schema)
+            self.schema_input_ids_cache[input.db_id] = (
+                db_file_mtime,
+                self.tokenizer(serialized_schema.strip(), add_special_tokens=False)["input_ids"],
+            )
+        _, schema_input_ids = self.schema_input_ids_cache[input.db_id]
+        # equivalent to tokenizing the output of `spider_get_input` for T5 tokenizers, see `_parse_and_tokenize`
+        question_input_ids = self.tokenizer(prefix + input.utterance.strip(), add_special_tokens=False)["input_ids"]
+        return self.tokenizer.build_inputs_with_special_tokens(question_input_ids + schema_input_ids)
+
     def postprocess(self, model_outputs: dict, return_type=ReturnType.TEXT, clean_up_tokenization_spaces=False):
         records = []
         for output_ids in model_outputs["output_ids"][0]:
@@ -189,7 +236,7 @@ class ConversationalText2SQLGenerationPipeline(Text2TextGenerationPipeline):
         self.schema_serialization_randomized: bool = kwargs.pop("schema_serialization_randomized", False)
         self.schema_serialization_with_db_id: bool = kwargs.pop("schema_serialization_with_db_id", True)
         self.schema_serialization_with_db_content: bool = kwargs.pop("schema_serialization_with_db_content", True)
-        self.schema_cache: Dict[str, dict] = dict()
+        self.schema_cache: Dict[str, Tuple[int, dict]] = dict()
         super().__init__(*args, **kwargs)
 
     def __call__(self, inputs: Union[ConversationalText2SQLInput, List[ConversationalText2SQLInput]], *args, **kwargs):
@@ -265,9 +312,12 @@ class ConversationalText2SQLGenerationPipeline(Text2TextGenerationPipeline):
 
     def _pre_process(self, input: ConversationalText2SQLInput) -> str:
         prefix = self.prefix if self.prefix is not None else ""
-        if input.db_id not in self.schema_cache:
-            self.schema_cache[input.db_id] = get_schema(db_path=self.db_path, db_id=input.db_id)
-        schema = self.schema_cache[input.db_id]
+        _, schema = get_cached_schema(
+            schema_cache=self.schema_cache,
+            db_path=self.db_path,
+            db_id=input.db_id,
+            refresh=not hasattr(self.model, "add_schema"),
+        )
         if hasattr(self.model, "add_schema"):
             self.model.add_schema(db_id=input.db_id, db_info=schema)
         serialized_schema = serialize_schema(
@@ -303,8 +353,23 @@ class ConversationalText2SQLGenerationPipeline(Text2TextGenerationPipeline):
         return records
 
 
+def get_db_file_path(db_path: str, db_id: str) -> str:
+    return db_path + "/" + db_id + "/" + db_id + ".sqlite"
+
+
+def get_cached_schema(
+    schema_cache: Dict[str, Tuple[int, dict]], db_path: str, db_id: str, refresh: bool = True
+) -> Tuple[int, dict]:
+    # Refresh the cached schema whenever the database file has been modified.
+    # Picard cannot replace a registered schema, hence models with Picard have to pass `refresh=False`.
+    db_file_mtime = os.stat(get_db_file_path(db_path=db_path, db_id=db_id)).st_mtime_ns
+    if db_id not in schema_cache or (refresh and schema_cache[db_id][0] != db_file_mtime):
+        schema_cache[db_id] = (db_file_mtime, get_schema(db_path=db_path, db_id=db_id))
+    return schema_cache[db_id]
+
+
 def get_schema(db_path: str, db_id: str) -> dict:
-    schema = dump_db_json_schema(db_path + "/" + db_id + "/" + db_id + ".sqlite", db_id)
+    schema = dump_db_json_schema(get_db_file_path(db_path=db_path, db_id=db_id), db_id)
     return {
         "db_table_names": schema["table_names_original"],
         "db_column_names": {
@@ -0,0 +1,67 @@
+import sqlite3
+import pytest
+from transformers.models.auto import AutoTokenizer
+from transformers.models.t5 import T5Config, T5ForConditionalGeneration
+from transformers.tokenization_utils_fast import PreTrainedTokenizerFast
+from seq2seq.utils.pipeline import Text2SQLGenerationPipeline, Text2SQLInput
+
+
+@pytest.fixture
+def db_path(tmpdir) -> str:
+    conn = sqlite3.connect(str(tmpdir.mkdir("concert_singer").join("concert_singer.sqlite")))
+    conn.executescript(
+        """
+        CREATE TABLE singer (Singer_ID INT PRIMARY KEY, Name TEXT, Country TEXT, Age INT);
+        CREATE TABLE concert (
+            concert_ID INT PRIMARY KEY,
+            concert_Name TEXT,
+            Year TEXT,
+            Singer_ID INT REFERENCES singer(Singer_ID)
+        );
+        """
+    )
+    conn.close()
+    return str(tmpdir)
+
+
+@pytest.fixture
+def tokenizer() -> PreTrainedTokenizerFast:
+    return AutoTokenizer.from_pretrained("t5-small")
+
+
+@pytest.fixture
+def model(tokenizer: PreTrainedTokenizerFast) -> T5ForConditionalGeneration:
+    # tokenization does not depend on the weights, hence a tiny randomly initialized model is enough
+    return T5ForConditionalGeneration(
+        T5Config(vocab_size=len(tokenizer), d_model=8, d_kv=4, d_ff=16, num_layers=1, num_heads=2)
+    )
+
+
+@pytest.fixture(params=["", "translate English to SQL: "])
+def pipeline(
+    request, db_path: str, model: T5ForConditionalGeneration, tokenizer: PreTrainedTokenizerFast
+) -> Text2SQLGenerationPipeline:
+    return Text2SQLGenerationPipeline(
+        model=model,
+        tokenizer=tokenizer,
+        db_path=db_path,
+        prefix=request.param,
+        schema_serialization_with_db_content=False,
+        device=-1,
+    )
+
+
+@pytest.mark.parametrize(
+    "utterance",
+    [
+        "How many singers do we have?",
+        "What are the names of the singers from France, ordered by age?",
+        "  Show the concert names from 2014 |  ",
+    ],
+)
+def test_get_input_ids(pipeline: Text2SQLGenerationPipeline, utterance: str) -> None:
+    input = Text2SQLInput(utterance=utterance, db_id="concert_singer")
+    expected_input_ids = pipeline.tokenizer(pipeline._pre_process(input=input))["input_ids"]
+    # the second call hits the cached schema token ids
+    assert pipeline._get_input_ids(input=input) == expected_input_ids
+    assert pipeline._get_input_ids(input=input) == expected_input_ids
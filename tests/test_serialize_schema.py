@@ -0,0 +1,61 @@
+import pytest
+from seq2seq.utils.dataset import serialize_schema
+
+
+# the `*` column belongs to no table, "Stadium" and "Empty" have no columns
+DB_COLUMN_NAMES = {
+    "table_id": [-1, 0, 0, 2, 2],
+    "column_name": ["*", "Singer_ID", "Name", "Concert_ID", "Singer_ID"],
+}
+DB_TABLE_NAMES = ["Singer", "Stadium", "Concert", "Empty"]
+
+
+@pytest.mark.parametrize(
+    "schema_serialization_type, schema_serialization_with_db_id, normalize_query, expected_serialized_schema",
+    [
+        (
+            "peteshaw",
+            True,
+            True,
+            " | concert_singer | singer : singer_id , name | stadium :  | concert : concert_id , singer_id | empty : ",
+        ),
+        (
+            "peteshaw",
+            False,
+            False,
+            " | Singer : Singer_ID , Name | Stadium :  | Concert : Concert_ID , Singer_ID | Empty : ",
+        ),
+        (
+            "verbose",
+            True,
+            True,
+            "Database: concert_singer. Table: singer. Columns: singer_id, name. Table: stadium. Columns: . "
+            "Table: concert. Columns: concert_id, singer_id. Table: empty. Columns: ",
+        ),
+        (
+            "verbose",
+            False,
+            False,
+            "Table: Singer. Columns: Singer_ID, Name. Table: Stadium. Columns: . "
+            "Table: Concert. Columns: Concert_ID, Singer_ID. Table: Empty. Columns: ",
+        ),
+    ],
+)
+def test_serialize_schema(
+    schema_serialization_type: str,
+    schema_serialization_with_db_id: bool,
+    normalize_query: bool,
+    expected_serialized_schema: str,
+) -> None:
+    serialized_schema = serialize_schema(
+        question="How many singers do we have?",
+        db_path="database",
+        db_id="concert_singer",
+        db_column_names=DB_COLUMN_NAMES,
+        db_table_names=DB_TABLE_NAMES,
+        schema_serialization_type=schema_serialization_type,
+        schema_serialization_with_db_id=schema_serialization_with_db_id,
+        schema_serialization_with_db_content=False,
+        normalize_query=normalize_query,
+    )
+    assert serialized_schema == expected_serialized_schema